@@ -12,7 +12,7 @@ Description:
     The script completes the following steps:
     1. Loads a dataframe with domains and associated Google News publication tokens
     2. Loads URLs already gathered in recent queries as a set
-    3. Fetches news data from Google news for each domain using the SERP API
+    3. Fetches news data from Google news for all domains concurrently using the SERP API
         3a. All SERP results are stored in a new-line delimited JSON file
         3b. URLS are stored in a new-line delimited text file, only new URLs are saved
 
@@ -22,21 +22,33 @@ Usage:
 Output:
     The script creates two files.
         1. SERP_FILE: Each line contains results from the Serp API. Will contain multiple URLs for
-            a specific domain.
+            a specific domain. This file is gzip compressed.
         2. LINKS_FILE: Each line contains one URL.
     All files are prefixed with the date the script is run: YYYY_MM_DD
 
 Author: Matthew DeVerna
 """
 
+import asyncio
 import datetime
-import json
+import gzip
 import os
+import random
+import re
 
+import aiohttp
 import pandas as pd
-from serpapi import GoogleSearch
 
-from reliable_db.utils import collect_last_x_files, random_wait, get_class_property_dict
+from reliable_db.utils import (
+    AsyncRateLimiter,
+    CompactLinkSet,
+    JsonlSink,
+    collect_last_x_files,
+    get_class_property_dict,
+    iter_file_lines,
+    json_dumps,
+    json_loads,
+)
 from reliable_db.serp_models import SerpGnewsArticle
 
 # Make sure we are in the proper directory for the relative output dirs/files
@@ -55,21 +67,52 @@ SERP_RAW_DIR = "../../../raw_data/article_data/serp_raw"
 SERP_CLEAN_DIR = "../../../raw_data/article_data/serp_clean"
 os.makedirs(SERP_RAW_DIR, exist_ok=True)
 os.makedirs(SERP_CLEAN_DIR, exist_ok=True)
-SERP_RAW_FILE = "serp_raw_results.jsonl"
+SERP_RAW_FILE = "serp_raw_results.jsonl.gz"
+SERP_RAW_COMPRESSLEVEL = 3  # Fast, while still compressing the repetitive JSON well
 SERP_CLEAN_FILE = "serp_clean_records.jsonl"
 
 # Number of days to consider for url cache
 NUM_DAYS = 14
 
+# SERP API request settings
+SERP_API_URL = "https://serpapi.com/search.json"
+MAX_REQUESTS_PER_SECOND = 5  # Keep below the account's requests/second limit
+MAX_ATTEMPTS = 5
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Searches are submitted asynchronously and their results polled from the archive
+SERP_ARCHIVE_URL = "https://serpapi.com/searches/{search_id}.json"
+SERP_POLL_INTERVAL = 2  # seconds
+SERP_MAX_POLLS = 150
+
+# Matches the "link" field of a serialized SERP clean record
+LINK_RE = re.compile(rb'"link"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
 # Set API key
 SERP_API_KEY = os.environ.get("SERP_API_KEY")
 if not SERP_API_KEY:
     raise ValueError("Missing SERP_API_KEY environment variable.")
 
 
+def extract_record_link(line):
+    """
+    Return the "link" field of a serialized SERP clean record (bytes), or None if
+    it is missing. The line is only fully parsed when the link contains escaped
+    characters.
+    """
+    match = LINK_RE.search(line)
+    if match is None:
+        return None
+    link = match.group(1)
+    if b"\\" in link:
+        return json_loads(line)["link"]
+    return link.decode("utf-8")
+
+
 def build_existing_links_set(files):
     """
     Builds a set of URLs already gathered in recent queries.
+    Only the "link" field is extracted from each record (see `extract_record_link`).
 
     Parameters
     ----------
@@ -77,39 +120,72 @@ def build_existing_links_set(files):
 
     Returns
     -------
-    set: A set of URLs already gathered in recent queries.
+    CompactLinkSet: A set of URLs already gathered in recent queries.
     """
-    urls = set()
     try:
-        for file in files:
-            with open(file, "r") as f:
-                for line in f:
-                    record = json.loads(line)
-                    urls.add(record["link"])
-        return urls
+        links = (
+            link
+            for file in files
+            for link in map(extract_record_link, iter_file_lines(file))
+            if link
+        )
+        return CompactLinkSet(links)
     except Exception as e:
         print("PROBLEM LOADING EXISTING LINKS!!")
         print(e)
 
 
-def fetch_serp_data(api_key, gnews_pub_token):
+async def request_serp_json(session, limiter, url, params):
+    """
+    Make a GET request to the SERP API and return the decoded JSON response.
+    Requests are paced by `limiter`. Rate limited (429) and server error (5xx)
+    responses are retried after the Retry-After header's delay, if provided, or
+    with exponential backoff, up to MAX_ATTEMPTS times.
+
+    Parameters
+    ----------
+    - session (aiohttp.ClientSession): The session used to make the request.
+    - limiter (AsyncRateLimiter): Rate limiter shared by all SERP API requests.
+    - url (str): The SERP API endpoint.
+    - params (dict): The query parameters for the request.
+
+    Returns
+    -------
+    dict: The decoded JSON response.
     """
-    Fetches data from the SERP API for a given domain using that domain's
-    associated "publisher token" for the Google News engine.
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        async with limiter, session.get(url, params=params) as response:
+            if response.status not in RETRY_STATUSES or attempt == MAX_ATTEMPTS:
+                response.raise_for_status()
+                return await response.json()
+            retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            await asyncio.sleep(int(retry_after))
+        else:
+            await asyncio.sleep(2**attempt + random.uniform(0, 1))
+
+
+async def submit_serp_search(session, limiter, api_key, gnews_pub_token):
+    """
+    Submits an asynchronous SERP API search for a given domain using that domain's
+    associated "publisher token" for the Google News engine. SERP API processes
+    the search in the background; results are retrieved with `fetch_serp_data`.
 
     Parameters
     ----------
+    - session (aiohttp.ClientSession): The session used to make the request.
+    - limiter (AsyncRateLimiter): Rate limiter shared by all SERP API requests.
     - api_key (str): The API key for SerpAPI.
     - gnews_pub_token (str): Google News publication token for the domain.
         - Ref: https://serpapi.com/playground?engine=google_news
 
     Returns
     -------
-    dict: A dictionary containing the fetched data from SERP API.
+    str: The SERP API search ID.
 
     Examples
     --------
-    serp_data = fetch_serp_data("your_api_key", "publication_token")
+    search_id = await submit_serp_search(session, limiter, "your_api_key", "publication_token")
     """
     if not isinstance(api_key, str):
         raise ValueError("api_key must be a string.")
@@ -121,9 +197,79 @@ def fetch_serp_data(api_key, gnews_pub_token):
         "engine": "google_news",
         "gl": "us",
         "publication_token": gnews_pub_token,
+        "async": "true",
     }
-    search = GoogleSearch(params)
-    return search.get_dict()
+    response = await request_serp_json(session, limiter, SERP_API_URL, params)
+    return response["search_metadata"]["id"]
+
+
+async def fetch_serp_data(session, limiter, api_key, search_id):
+    """
+    Fetches the results of a submitted SERP API search from the Searches Archive
+    API, polling every SERP_POLL_INTERVAL seconds until the search is complete.
+
+    Parameters
+    ----------
+    - session (aiohttp.ClientSession): The session used to make the request.
+    - limiter (AsyncRateLimiter): Rate limiter shared by all SERP API requests.
+    - api_key (str): The API key for SerpAPI.
+    - search_id (str): The search ID returned by `submit_serp_search`.
+
+    Returns
+    -------
+    dict: A dictionary containing the fetched data from SERP API.
+
+    Examples
+    --------
+    serp_data = await fetch_serp_data(session, limiter, "your_api_key", search_id)
+    """
+    url = SERP_ARCHIVE_URL.format(search_id=search_id)
+    params = {"api_key": api_key}
+    for _ in range(SERP_MAX_POLLS):
+        results = await request_serp_json(session, limiter, url, params)
+        status = results.get("search_metadata", {}).get("status")
+        if status == "Success":
+            return results
+        if status == "Error":
+            raise ValueError(f"SERP API search failed: {results.get('error')}")
+        await asyncio.sleep(SERP_POLL_INTERVAL)
+    raise TimeoutError(f"SERP API search {search_id} did not complete.")
+
+
+async def submit_domain_search(session, limiter, api_key, domain, gnews_pub_token):
+    """
+    Wrapper around `submit_serp_search` that keeps track of which domain the search
+    belongs to.
+
+    Returns
+    -------
+    tuple: (domain, gnews_pub_token, search_id), where search_id is the SERP API
+        search ID (str) or the exception raised while submitting the search.
+    """
+    try:
+        search_id = await submit_serp_search(session, limiter, api_key, gnews_pub_token)
+    except Exception as e:
+        search_id = e
+    return domain, gnews_pub_token, search_id
+
+
+async def fetch_domain_results(
+    session, limiter, api_key, domain, gnews_pub_token, search_id
+):
+    """
+    Wrapper around `fetch_serp_data` that keeps track of which domain the results
+    belong to.
+
+    Returns
+    -------
+    tuple: (domain, gnews_pub_token, results), where results is the SERP API
+        response (dict) or the exception raised while fetching it.
+    """
+    try:
+        results = await fetch_serp_data(session, limiter, api_key, search_id)
+    except Exception as e:
+        results = e
+    return domain, gnews_pub_token, results
 
 
 def extract_links(news_results):
@@ -168,7 +314,7 @@ def main(quality_domains_df, api_key):
     -------
     None
     Saves two files:
-    - SERP_RAW_FILE: Each line contains results from the Serp API.
+    - SERP_RAW_FILE: Each line contains results from the Serp API (gzip compressed).
     - SERP_CLEAN_FILE: Each line contains a record for a single article.
 
     Examples
@@ -186,49 +332,85 @@ def main(quality_domains_df, api_key):
 
     print(f"Existing links (from last {NUM_DAYS} days): {len(existing_links)}")
 
-    num_domains = len(quality_domains_df)
-    for idx, row in quality_domains_df.iterrows():
-        print(f"Source {idx + 1}/{num_domains}: {row.domain}...")
-
-        # Be nice by waiting, except for first call.
-        if idx != 0:
-            random_wait()
+    asyncio.run(
+        collect_serp_results(
+            quality_domains_df, api_key, serp_fp, serp_clean_fp, existing_links
+        )
+    )
 
-        with open(serp_fp, "a") as f_serp:
-            try:
-                results = fetch_serp_data(api_key, row.gnews_pub_token)
-                json_line = f"{json.dumps(results)}\n"
-                f_serp.write(json_line)
 
-                if not results.get("news_results", None):
-                    print("\t - *** No news results found. ***")
+async def collect_serp_results(
+    quality_domains_df, api_key, serp_fp, serp_clean_fp, existing_links
+):
+    """
+    Fetch SERP results for all domains concurrently, saving each response as soon
+    as it arrives. See `main` for details.
+    """
+    limiter = AsyncRateLimiter(MAX_REQUESTS_PER_SECOND, time_period=1)
+    async with aiohttp.ClientSession() as session:
+        # Submit all searches up front, then collect results as they complete
+        submissions = await asyncio.gather(
+            *[
+                submit_domain_search(session, limiter, api_key, domain, gnews_pub_token)
+                for domain, gnews_pub_token in zip(
+                    quality_domains_df["domain"].values,
+                    quality_domains_df["gnews_pub_token"].values,
+                )
+            ]
+        )
+        tasks = []
+        for domain, gnews_pub_token, search_id in submissions:
+            if isinstance(search_id, Exception):
+                print(f"Error submitting search for domain {domain}: {search_id}")
+                print("-" * 50)
+                continue
+            tasks.append(
+                fetch_domain_results(
+                    session, limiter, api_key, domain, gnews_pub_token, search_id
+                )
+            )
+
+        with gzip.open(
+            serp_fp, "ab", compresslevel=SERP_RAW_COMPRESSLEVEL
+        ) as f_serp, JsonlSink(serp_clean_fp) as f_serp_clean:
+            for idx, task in enumerate(asyncio.as_completed(tasks), start=1):
+                domain, gnews_pub_token, results = await task
+                print(f"Source {idx}/{len(tasks)}: {domain}...")
+
+                if isinstance(results, Exception):
+                    print(f"Error processing domain {domain}: {results}")
+                    print("-" * 50)
                     continue
 
-                else:
+                try:
+                    f_serp.write(json_dumps(results))
+                    f_serp.write(b"\n")
+
+                    if not results.get("news_results", None):
+                        print("\t - *** No news results found. ***")
+                        continue
+
                     new_article_cnt = 0
-                    with open(serp_clean_fp, "a") as f_serp_clean:
-                        for result in results["news_results"]:
-                            # Ingest the article data with the class and convert it to a dict
-                            serp_obj = SerpGnewsArticle(result)
-                            record = get_class_property_dict(serp_obj)
-
-                            # Ignore if it has already been saved
-                            if record["link"] in existing_links:
-                                continue
-
-                            # Otherwise, add domain/publisher token and save
-                            record.update(
-                                {"domain": row.domain, "pub_token": row.gnews_pub_token}
-                            )
-                            json_line = f"{json.dumps(record)}\n"
-                            f_serp_clean.write(json_line)
-                            new_article_cnt += 1
+                    for result in results["news_results"]:
+                        # Ignore if it has already been saved. Checked on the raw result
+                        # so records are only built for new articles.
+                        if result.get("link") in existing_links:
+                            continue
+
+                        # Ingest the article data with the class and convert it to a dict
+                        serp_obj = SerpGnewsArticle(result)
+                        record = get_class_property_dict(serp_obj)
+
+                        # Add domain/publisher token and save
+                        record.update({"domain": domain, "pub_token": gnews_pub_token})
+                        f_serp_clean.write(record)
+                        new_article_cnt += 1
 
                     print(f"\t- New links added: {new_article_cnt}")
 
-            except Exception as e:
-                print(f"Error processing domain {row.domain}: {e}")
-                print("-" * 50)
+                except Exception as e:
+                    print(f"Error processing domain {domain}: {e}")
+                    print("-" * 50)
 
 
 if __name__ == "__main__":
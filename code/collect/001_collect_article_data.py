@@ -11,7 +11,7 @@ Description:
     1. Loads downloaded Google News data from SERP from the past few days.
     2. Loads a set of URLs that have already been downloaded.
         2a. URLs that have already been downloaded are excluded.
-    3. Uses newspaper3k to download articles.
+    3. Downloads articles concurrently and parses them with newspaper3k.
         3a. The article details are stored in a new-line delimited JSON file.
         3b. The URL is stored in a file cache for that day.
 
@@ -27,13 +27,25 @@ Output:
 Author: Matthew DeVerna
 """
 
+import asyncio
 import datetime
-import json
 import os
+import pickle
 
-from newspaper import Article
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlparse
 
-from reliable_db.utils import collect_last_x_files, random_wait
+import aiohttp
+from newspaper import Article, Config
+
+from reliable_db.utils import (
+    CompactLinkSet,
+    JsonlSink,
+    collect_last_x_files,
+    iter_file_lines,
+    json_loads,
+)
 
 # Make sure we are in the proper directory for the relative output dirs/files
 CURR_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -52,36 +64,189 @@ os.makedirs(ARTICLE_RECORDS_DIR, exist_ok=True)
 ARTICLE_FILE = "article_results.jsonl"
 LINKS_FILE = "links.txt"
 
+# Links already read from each link cache file, so unchanged files are not re-read
+LINKS_PICKLE_DIR = "../../../raw_data/article_data/cache"
+os.makedirs(LINKS_PICKLE_DIR, exist_ok=True)
+LINKS_PICKLE_FILE = "downloaded_links.pkl"
+
 # Number of days to consider for url cache
 NUM_DAYS = 14
 
+# Maximum number of simultaneous downloads from a single host
+MAX_REQUESTS_PER_HOST = 10
+
+# Size of the connection pool shared by all downloads and how long (seconds)
+# idle connections are kept open for reuse
+MAX_CONNECTIONS = 64
+KEEPALIVE_TIMEOUT = 60
+
+# How long (seconds) resolved host addresses are cached
+DNS_CACHE_TTL = 600
+
+# Seconds to wait for a single article download
+REQUEST_TIMEOUT = 30
+
 
-def download_article_text(url):
+async def fetch_html(session, sem, url):
     """
-    Use newspaper3k to download the text of an article specified by the url.
+    Download the raw HTML of an article specified by the url.
 
     Parameters
     ----------
+    - session (aiohttp.ClientSession): The session used to make the request
+    - sem (asyncio.Semaphore): Semaphore limiting concurrent requests to the url's host
     - url (str): The URL of the article to download
 
+    Returns
+    -------
+    html (str): The HTML of the article, empty if the download failed
+    """
+    try:
+        timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+        async with sem, session.get(url, timeout=timeout) as response:
+            response.raise_for_status()
+            return await response.text(errors="replace")
+    except Exception as e:
+        print(f"Error downloading article html: {url}")
+        print(e)
+        return ""
+
+
+def parse_html(url, html):
+    """
+    Use newspaper3k to extract the text of an article from its HTML.
+
+    Parameters
+    ----------
+    - url (str): The URL of the article
+    - html (str): The HTML of the article
+
     Returns
     -------
     article_text (str): The text of the article
     """
+    if not html:
+        return ""
     try:
         n3k_article = Article(url)
-        n3k_article.download()
+        n3k_article.set_html(html)
         n3k_article.parse()
         return n3k_article.text
     except Exception as e:
-        print(f"Error downloading article text: {url}")
+        print(f"Error parsing article text: {url}")
         print(e)
         return ""
 
 
+async def download_article(session, sem, pool, article):
+    """
+    Download the HTML of an article and parse its text in a separate process.
+
+    Parameters
+    ----------
+    - session (aiohttp.ClientSession): The session used to make the request
+    - sem (asyncio.Semaphore): Semaphore limiting concurrent requests to the url's host
+    - pool (concurrent.futures.ProcessPoolExecutor): The pool that parses the HTML
+    - article (dict): The record for a news article
+
+    Returns
+    -------
+    tuple: (article, article_text)
+    """
+    html = await fetch_html(session, sem, article["link"])
+    loop = asyncio.get_running_loop()
+    text = await loop.run_in_executor(pool, parse_html, article["link"], html)
+    return article, text
+
+
+async def download_articles(article_records):
+    """
+    Download and parse the text of many articles concurrently.
+    - HTML is fetched concurrently, with at most MAX_REQUESTS_PER_HOST requests
+        in flight to any single host
+    - All requests share one connection pool, so connections (and TLS sessions)
+        to the same host are reused and DNS lookups are cached
+    - Parsing is CPU-bound, so it is handled by a pool of processes while other
+        downloads are still in flight
+
+    Parameters
+    ----------
+    - article_records (list): A list of records for news articles.
+
+    Yields
+    -------
+    tuple: (article, article_text), in the order the articles finish
+    """
+    host_sems = defaultdict(lambda: asyncio.Semaphore(MAX_REQUESTS_PER_HOST))
+    headers = {"User-Agent": Config().browser_user_agent}
+    connector = aiohttp.TCPConnector(
+        limit=MAX_CONNECTIONS,
+        limit_per_host=MAX_REQUESTS_PER_HOST,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+        use_dns_cache=True,
+        ttl_dns_cache=DNS_CACHE_TTL,
+    )
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as pool:
+        async with aiohttp.ClientSession(
+            connector=connector, headers=headers
+        ) as session:
+            tasks = [
+                download_article(
+                    session, host_sems[urlparse(r["link"]).netloc], pool, r
+                )
+                for r in article_records
+            ]
+            for task in asyncio.as_completed(tasks):
+                yield await task
+
+
+async def save_articles(article_records, article_fp, links_fp):
+    """
+    Download articles and save them as they finish. All writes happen here, in a
+    single coroutine, so records are never written concurrently.
+
+    Parameters
+    ----------
+    - article_records (list): A list of records for news articles to download.
+    - article_fp (str): The path to the article records output file
+    - links_fp (str): The path to the downloaded links cache file
+
+    Returns
+    -------
+    int: The number of new articles saved
+    """
+    num_new_articles = 0
+    num_records = len(article_records)
+
+    # Open output files for new records and links cache
+    with JsonlSink(article_fp) as f_art, JsonlSink(links_fp) as f_links:
+        try:
+            async for article, text in download_articles(article_records):
+                num_new_articles += 1
+                link = article["link"]
+                print(f"Processing article {num_new_articles}/{num_records}")
+                print(f"\t- URL: {link}")
+
+                # Add the downloaded article text to the record
+                article["text"] = text
+
+                # Save article record and the downloaded link in the cache
+                f_art.write(article)
+                f_links.write_line(link)
+
+        except Exception as e:
+            print(f"Error processing articles: {e}")
+            print("-" * 50)
+
+    return num_new_articles
+
+
 def load_downloaded_links(files):
     """
     Extract URLs from processed article links.
+    The links of each file are stored as a CompactLinkSet (8 bytes per link) and
+    pickled alongside the file's modification time, so only new or updated files
+    are read on the next run.
 
     Parameters
     ----------
@@ -89,19 +254,60 @@ def load_downloaded_links(files):
 
     Returns
     ---------
-    (list): A list of article urls.
+    CompactLinkSet: The article urls.
     """
     try:
-        urls = set()
+        pickle_fp = os.path.join(LINKS_PICKLE_DIR, LINKS_PICKLE_FILE)
+        cached_links = load_cached_links(pickle_fp)
+
+        file_links = {}
         for file in files:
-            with open(file, "r") as f:
-                for line in f:
-                    urls.add(line.rstrip())
-        return urls
+            mtime = os.stat(file).st_mtime_ns
+            cached_mtime, cached_file_links = cached_links.get(file, (None, None))
+            # Caches pickled before links were stored as digests are rebuilt
+            if cached_mtime == mtime and isinstance(cached_file_links, CompactLinkSet):
+                file_links[file] = (mtime, cached_file_links)
+                continue
+            links = CompactLinkSet(
+                line.rstrip().decode("utf-8") for line in iter_file_lines(file)
+            )
+            file_links[file] = (mtime, links)
+
+        # Only files still in the cache window are saved
+        tmp_fp = f"{pickle_fp}.tmp"
+        with open(tmp_fp, "wb") as f:
+            pickle.dump(file_links, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_fp, pickle_fp)
+
+        return CompactLinkSet.union(links for _, links in file_links.values())
     except Exception as e:
         print("PROBLEM LOADING EXISTING LINKS!!")
         print(e)
-        return set()
+        return CompactLinkSet()
+
+
+def load_cached_links(path):
+    """
+    Load the links previously read from each link cache file.
+
+    Parameters
+    ----------
+    - path (str): The path to the pickle file
+
+    Returns
+    -------
+    dict: Maps link file paths to a (modification time, CompactLinkSet) tuple.
+        Empty if the pickle file does not exist or cannot be read.
+    """
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except Exception as e:
+        print("PROBLEM LOADING CACHED LINKS, REBUILDING!!")
+        print(e)
+        return {}
 
 
 def load_article_records(path):
@@ -117,8 +323,8 @@ def load_article_records(path):
     list: A list of article records
     """
     try:
-        with open(path, "r") as f:
-            records = [json.loads(line) for line in f]
+        with open(path, "rb") as f:
+            records = [json_loads(line) for line in f]
             return records
     except Exception as e:
         print("PROBLEM LOADING ARTICLE RECORDS!!")
@@ -152,44 +358,22 @@ def process_articles(article_records):
     files = collect_last_x_files(path=DOWNLOADED_LINKS_DIR, max_paths=NUM_DAYS)
     downloaded_links_set = load_downloaded_links(files)
 
-    wait_bool = False
-    # Open output files for new records and links cache
-    with open(article_fp, "a") as f_art, open(links_fp, "a") as f_links:
-        try:
-            num_new_articles = 0
-            num_skipped_articles = 0
-            num_records = len(article_records)
-            for idx, article in enumerate(article_records, start=1):
-                # Be nice, wait if needed
-                if wait_bool:
-                    random_wait()
-
-                link = article["link"]
-                if link in downloaded_links_set:
-                    # print("\t- Already processed, skipping")
-                    wait_bool = False
-                    num_skipped_articles += 1
-                    continue
-
-                print(f"Processing article {idx}/{num_records}")
-                print(f"\t- URL: {link}")
-
-                # Download article text, add it to the record
-                article["text"] = download_article_text(link)
-
-                # Save article record
-                json_line = f"{json.dumps(article)}\n"
-                f_art.write(json_line)
-
-                # Save the downloaded link in the cache
-                f_links.write(f"{link}\n")
-                wait_bool = True
-
-                num_new_articles += 1
-
-        except Exception as e:
-            print(f"Error processing URL <{article['link']}>: {e}")
-            print("-" * 50)
+    # Filter once up front: skip links already downloaded and repeated links
+    to_process = []
+    seen_links = set()
+    for article in article_records:
+        link = article["link"]
+        if link in downloaded_links_set or link in seen_links:
+            continue
+        seen_links.add(link)
+        to_process.append(article)
+    num_skipped_articles = len(article_records) - len(to_process)
+
+    # Group articles from the same host so their requests reuse open connections
+    to_process.sort(key=lambda r: urlparse(r["link"]).netloc)
+
+    print(f"Downloading {len(to_process):,} articles...")
+    num_new_articles = asyncio.run(save_articles(to_process, article_fp, links_fp))
 
     print(f"Number of new articles    : {num_new_articles:,}")
     print(f"Number of skipped articles: {num_skipped_articles:,}\n")
@@ -11,56 +11,68 @@ Description:
     1. Loads downloaded news article text data from the past few days.
     2. Loads a set of URLs for articles that have already been summarized.
         2a. URLs that have already been summarized are excluded.
-    3. Uses OpenAI (gpt-3.5-turbo) to summarize articles (temperature=0).
+    3. Uses OpenAI (gpt-3.5-turbo) to summarize articles concurrently (temperature=0).
         3a. The summary and API call information (tokens utilized, date created, etc)
             are combined with the existing record and saved to a new file for that day
         3b. The URL is stored in a file cache for that day.
 
 Usage:
-    python 002_summarize_article_data.py
+    python 002_summarize_article_data.py [--batch_api]
+
+    --batch_api: summarize with the OpenAI Batch API (half the cost, results within
+        24 hours) instead of real-time requests.
 
 Output:
     The script creates (or appends to) two new-line delimited files for the day it is run.
     1. LINKS_FILE (.txt): Each line contains a URL that has been summarized
     2. SUMMARY_FILE (.jsonl): Each line contains a dictionary record for a specific article.
-        Will contain details about the article such as title, author, text, etc. as well as
-        a summary of that article, and information about the OpenAI call.
+        Will contain details about the article such as title, author, etc. as well as
+        a summary of that article, and information about the OpenAI call. The full
+        article text is not stored again (it is in the article records).
 
 Author: Matthew DeVerna
 """
 
+import argparse
+import asyncio
 import datetime
-import json
+import fcntl
+import logging
 
 import os
+import sys
 
 from tenacity import retry, stop_after_attempt, wait_random_exponential
 
 # Set up OpenAI client
-from openai import OpenAI
+from openai import AsyncOpenAI, RateLimitError
+from openai.types.chat import ChatCompletion
 
 api_key = os.environ["OPENAI_OSOME_API_KEY"]
-openai_client = OpenAI(api_key=api_key)
+openai_client = AsyncOpenAI(api_key=api_key)
 
 from reliable_db.utils import (
+    AsyncRateLimiter,
+    JsonlSink,
     collect_last_x_files,
-    get_nested_attr,
-    trim_text_to_token_limit,
+    json_dumps,
+    json_loads,
+    start_queue_logging,
+    trim_texts_to_token_limit,
 )
 
+logger = logging.getLogger(__name__)
+
 # Make sure we are in the proper directory for the relative output dirs/files
 CURR_DIR = os.path.dirname(os.path.abspath(__file__))
 if os.getcwd() != CURR_DIR:
     os.chdir(CURR_DIR)
 
 PROMPT1 = (
-    "As a helpful AI assistant, your task will be to summarize text from a news article, "
-    "which may contain incomplete sentences, HTML tags, and non-textual elements. "
-    "Begin by cleansing the text of any irrelevant content or formatting issues. "
-    "Then, craft a concise, neutral summary of the main news article, highlighting key "
-    "facts: who, what, when, where, and why. Aim for a one-paragraph summary without "
-    "editorializing or subjective interpretation. Adhere strictly to these instructions for an accurate, unbiased summary."
+    "Summarize the news article in one neutral paragraph covering who, what, when, "
+    "where, and why. Ignore HTML and boilerplate. No editorializing."
 )
+SYSTEM_MSG = {"role": "system", "content": PROMPT1}
 
 # Input dataframe
 ARTICLE_RECORDS_DIR = "../../../raw_data/article_data/article_results"
@@ -73,15 +85,100 @@ os.makedirs(DOWNLOADED_LINKS_DIR, exist_ok=True)
 SUMMARY_FILE = "article_results_summarized.jsonl"
 LINKS_FILE = "links.txt"
 
+# Held for the whole run so that overlapping runs cannot summarize the same articles
+LOCK_FILE = ".summarize.lock"
+
 # Number of days to consider for url cache
 NUM_DAYS = 14
 
+# Maximum number of simultaneous summarization requests
+MAX_CONCURRENT_REQUESTS = 10
+
+# Number of summarized records to collect before writing them and buffer size (bytes)
+WRITE_BATCH_SIZE = 64
+WRITE_BUFFER_SIZE = 1 << 20
+
+# Account rate limits, updated from the x-ratelimit-* headers of each response
+REQUESTS_PER_MINUTE = 3_500
+TOKENS_PER_MINUTE = 90_000
+
+# Maximum number of article tokens sent in a request (chat completions add tokens
+# beyond the model's 4097 limit)
+MAX_ARTICLE_TOKENS = 3500
+
+# Maximum length of a summary (a one-paragraph summary is <= ~200 tokens). Also used
+# to estimate the tokens a request will use, as OpenAI counts it against the limit
+MAX_COMPLETION_TOKENS = 220
+
+# Batch API input files and how often (seconds) to check a batch's status
+BATCH_INPUT_DIR = "../../../raw_data/article_data/summary_batches"
+os.makedirs(BATCH_INPUT_DIR, exist_ok=True)
+BATCH_INPUT_FILE = "batch_input.jsonl"
+BATCH_POLL_INTERVAL = 60
+BATCH_FINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+class OpenAIRateLimiter:
+    """
+    Paces OpenAI requests to stay below both the requests-per-minute and the
+    tokens-per-minute rate limits, rather than retrying after being rate limited.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        """
+        Initialize the class.
+
+        Parameters
+        ----------
+        - requests_per_minute (int): the account's requests-per-minute limit
+        - tokens_per_minute (int): the account's tokens-per-minute limit
+        """
+        self.requests = AsyncRateLimiter(requests_per_minute, time_period=60)
+        self.tokens = AsyncRateLimiter(tokens_per_minute, time_period=60)
+
+    async def acquire(self, num_tokens):
+        """
+        Wait until there is capacity for one request using `num_tokens` tokens.
+        """
+        await self.requests.acquire()
+        await self.tokens.acquire(min(num_tokens, self.tokens.max_rate))
+
+    def update_limits(self, headers):
+        """
+        Update the rate limits from the x-ratelimit-* headers of an OpenAI response.
+        """
+        limit_requests = headers.get("x-ratelimit-limit-requests", "")
+        if limit_requests.isdigit():
+            self.requests.max_rate = int(limit_requests)
+        limit_tokens = headers.get("x-ratelimit-limit-tokens", "")
+        if limit_tokens.isdigit():
+            self.tokens.max_rate = int(limit_tokens)
+
+    def back_off(self, seconds):
+        """
+        Pause all requests for `seconds`, e.g., after being rate limited.
+        """
+        self.requests.drain(seconds)
+        self.tokens.drain(seconds)
+
+
+rate_limiter = OpenAIRateLimiter(REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE)
+
+
+def build_messages(article_text):
+    """
+    Build the chat completions messages asking the model to summarize `article_text`.
+    The static system message comes first and the article is the entire user
+    message, so every request shares the same prefix for OpenAI's prompt caching.
+    """
+    return [SYSTEM_MSG, {"role": "user", "content": article_text}]
+
 
 # Decorator applies exponentially backoffs to the function, retrying up to six times
 @retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(6))
-def summarize(article_text, model="gpt-3.5-turbo", raw=True):
+async def summarize(article_text, model="gpt-3.5-turbo", raw=True):
     """
-    Summarize article text.
+    Summarize article text. Requests are paced by `rate_limiter`.
 
     Parameters:
     ------------
@@ -96,19 +193,34 @@ def summarize(article_text, model="gpt-3.5-turbo", raw=True):
     - If raw == False: return the summary text only.
     """
     try:
-        messages = [
-            {"role": "system", "content": PROMPT1},
-            {"role": "user", "content": f"Article text: {article_text}."},
-        ]
-        response = openai_client.chat.completions.create(
-            model=model, messages=messages, temperature=0
+        messages = build_messages(article_text)
+
+        # Rough token estimate: ~4 characters per token
+        num_tokens = len(article_text) // 4 + MAX_COMPLETION_TOKENS
+        await rate_limiter.acquire(num_tokens)
+
+        raw_response = await openai_client.chat.completions.with_raw_response.create(
+            model=model,
+            messages=messages,
+            temperature=0,
+            max_tokens=MAX_COMPLETION_TOKENS,
         )
+        rate_limiter.update_limits(raw_response.headers)
+        response = raw_response.parse()
         if raw:
             return response
         content = response.choices[0].message.content
         return content
+    except RateLimitError as e:
+        logger.error(f"Error: {e}")
+        try:
+            retry_after = float(e.response.headers.get("retry-after", 1))
+        except ValueError:
+            retry_after = 1
+        rate_limiter.back_off(retry_after)
+        raise
     except Exception as e:
-        print(f"Error: {e}")
+        logger.error(f"Error: {e}")
         raise
 
 
@@ -130,33 +242,28 @@ def parse_response(response):
             - total_tokens (int): total number of tokens processed in query
             - completion_tokens (int): number of tokens utilized for completiong
             - prompt_tokens (int): number of tokens utilized in prompt
+            - cached_tokens (int): number of prompt tokens served from OpenAI's
+                prompt cache
             - time_created (int): unix timestamp of when the query was called
             - model (str): name of the model utilized
     """
-    # Initialize the simplified dictionary
-    clean_response = {"article_summary": None, "finish_reason": None}
-
-    # Extract the message response
-    if hasattr(response, "choices") and len(response.choices) > 0:
-        clean_response["article_summary"] = get_nested_attr(
-            response.choices[0], ["message", "content"], None
-        )
-        clean_response["finish_reason"] = get_nested_attr(
-            response.choices[0], ["finish_reason"], None
-        )
-
-    # Extract query details. Token counts assigned as zero if not found
-    clean_response["total_tokens"] = get_nested_attr(
-        response, ["usage", "total_tokens"], 0
-    )
-    clean_response["completion_tokens"] = get_nested_attr(
-        response, ["usage", "completion_tokens"], 0
-    )
-    clean_response["prompt_tokens"] = get_nested_attr(
-        response, ["usage", "prompt_tokens"], 0
-    )
-    clean_response["time_created"] = get_nested_attr(response, ["created"], None)
-    clean_response["model"] = get_nested_attr(response, ["model"], None)
+    # Dump the pydantic response to a dict once, instead of walking its attributes
+    response_dict = response.model_dump()
+    choice = (response_dict.get("choices") or [{}])[0]
+    usage = response_dict.get("usage") or {}
+    prompt_tokens_details = usage.get("prompt_tokens_details") or {}
+
+    # Token counts assigned as zero if not found
+    clean_response = {
+        "article_summary": (choice.get("message") or {}).get("content"),
+        "finish_reason": choice.get("finish_reason"),
+        "total_tokens": usage.get("total_tokens") or 0,
+        "completion_tokens": usage.get("completion_tokens") or 0,
+        "prompt_tokens": usage.get("prompt_tokens") or 0,
+        "cached_tokens": prompt_tokens_details.get("cached_tokens") or 0,
+        "time_created": response_dict.get("created"),
+        "model": response_dict.get("model"),
+    }
 
     return clean_response
 
@@ -171,19 +278,19 @@ def load_downloaded_links(files):
 
     Returns
     ---------
-    (list): A list of article urls.
+    (frozenset): An immutable set of article urls.
     """
     try:
         urls = set()
         for file in files:
+            # Read and split each file in one call rather than looping over lines
             with open(file, "r") as f:
-                for line in f:
-                    urls.add(line.rstrip())
-        return urls
+                urls.update(f.read().splitlines())
+        return frozenset(urls)
     except Exception as e:
-        print("PROBLEM LOADING EXISTING LINKS!!")
-        print(e)
-        return set()
+        logger.error("PROBLEM LOADING EXISTING LINKS!!")
+        logger.error(e)
+        return frozenset()
 
 
 def load_article_records(path):
@@ -199,26 +306,221 @@ def load_article_records(path):
     list: A list of article records
     """
     try:
-        with open(path, "r") as f:
-            records = [json.loads(line) for line in f]
+        with open(path, "rb") as f:
+            records = [json_loads(line) for line in f.read().splitlines() if line]
             return records
     except Exception as e:
-        print("PROBLEM LOADING ARTICLE RECORDS!!")
-        print(e)
+        logger.error("PROBLEM LOADING ARTICLE RECORDS!!")
+        logger.error(e)
         return []
 
 
-def summarize_articles(article_records):
+def trim_article_texts(article_records):
+    """
+    Replace the article text of each record with 'trimmed_text', the text trimmed to
+    MAX_ARTICLE_TOKENS tokens. All texts are tokenized in one batch across threads.
+    The full text is removed so it is not saved with the summary.
+
+    Parameters
+    ----------
+    - article_records (list): A list of records for news articles. Must contain 'text'
+
+    Returns
+    -------
+    None. Records are updated in place.
+    """
+    texts = [article.pop("text") for article in article_records]
+    trimmed_texts = trim_texts_to_token_limit(texts, max_tokens=MAX_ARTICLE_TOKENS)
+    for article, trimmed_text in zip(article_records, trimmed_texts):
+        article["trimmed_text"] = trimmed_text
+
+
+def save_summaries(articles, f_art, f_links):
+    """
+    Save a batch of summarized article records and cache their links, with a
+    single write call per file. Summaries are synced to disk before their links,
+    so a crash cannot leave a link cached without its summary, and the links are
+    synced right after to keep the window for re-summarizing articles small.
+
+    Parameters
+    ----------
+    - articles (list): Summarized records for news articles
+    - f_art (JsonlSink): The article summaries output file
+    - f_links (JsonlSink): The summarized links cache file
+    """
+    for article in articles:
+        f_art.write(article)
+        f_links.write_line(article["link"])
+    f_art.sync()
+    f_links.sync()
+
+
+async def summarize_article(sem, article):
+    """
+    Summarize a single article and add the parsed response to its record.
+
+    Parameters
+    ----------
+    - sem (asyncio.Semaphore): Semaphore limiting the number of concurrent requests
+    - article (dict): A record for a news article. Must contain 'link' and
+        'trimmed_text'
+
+    Returns
+    -------
+    dict or None: The updated article record, or None if summarization failed
+    """
+    link = article["link"]
+    trimmed_text = article.pop("trimmed_text")
+    try:
+        async with sem:
+            logger.info(f"\t- Summarizing URL: {link}")
+
+            # Make request, parse response and add to the record
+            response = await summarize(article_text=trimmed_text, raw=True)
+
+        article.update(parse_response(response))
+        return article
+
+    except Exception as e:
+        logger.error(f"Error processing URL <{link}>: {e}")
+        logger.info("-" * 50)
+        return None
+
+
+async def summarize_all(article_records, f_art, f_links):
+    """
+    Summarize articles concurrently, with at most MAX_CONCURRENT_REQUESTS
+    requests to OpenAI in flight. Summarized records are saved in batches of
+    WRITE_BATCH_SIZE as they complete.
+
+    Parameters
+    ----------
+    - article_records (list): A list of records for news articles to summarize.
+    - f_art (JsonlSink): The article summaries output file
+    - f_links (JsonlSink): The summarized links cache file
+
+    Returns
+    -------
+    int: The number of articles summarized
+    """
+    sem = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    tasks = [summarize_article(sem, article) for article in article_records]
+
+    num_new_articles = 0
+    summarized = []
+    for task in asyncio.as_completed(tasks):
+        article = await task
+        if article is None:
+            continue
+        summarized.append(article)
+        num_new_articles += 1
+        if len(summarized) >= WRITE_BATCH_SIZE:
+            save_summaries(summarized, f_art, f_links)
+            summarized.clear()
+
+    save_summaries(summarized, f_art, f_links)
+    return num_new_articles
+
+
+async def summarize_with_batch_api(
+    article_records, f_art, f_links, model="gpt-3.5-turbo"
+):
+    """
+    Summarize articles with the OpenAI Batch API.
+    - Uploads one request per article (the article link is the request's custom_id)
+    - Creates a batch and waits for it to finish, checking every BATCH_POLL_INTERVAL seconds
+    - Downloads the results and saves each summarized article
+
+    Parameters
+    ----------
+    - article_records (list): A list of records for news articles to summarize.
+    - f_art (JsonlSink): The article summaries output file
+    - f_links (JsonlSink): The summarized links cache file
+    - model (str): An OpenAI chat completions model (default = gpt-3.5-turbo)
+
+    Returns
+    -------
+    int: The number of articles summarized
+    """
+    # Each custom_id must be unique within a batch
+    articles_by_link = {article["link"]: article for article in article_records}
+    if not articles_by_link:
+        return 0
+
+    today_str = datetime.date.today().strftime("%Y_%m_%d")
+    batch_input_fp = os.path.join(BATCH_INPUT_DIR, f"{today_str}__{BATCH_INPUT_FILE}")
+    with open(batch_input_fp, "wb") as f:
+        for link, article in articles_by_link.items():
+            request = {
+                "custom_id": link,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": model,
+                    "messages": build_messages(article.pop("trimmed_text")),
+                    "temperature": 0,
+                    "max_tokens": MAX_COMPLETION_TOKENS,
+                },
+            }
+            f.write(json_dumps(request) + b"\n")
+
+    with open(batch_input_fp, "rb") as f:
+        batch_input_file = await openai_client.files.create(file=f, purpose="batch")
+    batch = await openai_client.batches.create(
+        input_file_id=batch_input_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+    logger.info(f"Created batch {batch.id}, waiting for it to complete...")
+
+    while batch.status not in BATCH_FINAL_STATUSES:
+        await asyncio.sleep(BATCH_POLL_INTERVAL)
+        batch = await openai_client.batches.retrieve(batch.id)
+        logger.info(f"\t- Batch status: {batch.status}")
+
+    if batch.status != "completed" or not batch.output_file_id:
+        logger.error(f"Batch {batch.id} did not complete: {batch.status}")
+        return 0
+
+    num_new_articles = 0
+    summarized = []
+    output = await openai_client.files.content(batch.output_file_id)
+    for line in output.text.splitlines():
+        result = json_loads(line)
+        link = result["custom_id"]
+        batch_response = result.get("response") or {}
+        if batch_response.get("status_code") != 200:
+            logger.error(f"Error processing URL <{link}>: {result.get('error')}")
+            logger.info("-" * 50)
+            continue
+
+        response = ChatCompletion.model_validate(batch_response["body"])
+        article = articles_by_link[link]
+        article.update(parse_response(response))
+        summarized.append(article)
+        num_new_articles += 1
+        if len(summarized) >= WRITE_BATCH_SIZE:
+            save_summaries(summarized, f_art, f_links)
+            summarized.clear()
+
+    save_summaries(summarized, f_art, f_links)
+
+    return num_new_articles
+
+
+def summarize_articles(article_records, use_batch_api=False):
     """
     Summarize a list of downloaded articles with OpenAI.
-    - Loads article records from the past few days
-    - Skips articles that have already been summarized
+    - Summarizes articles concurrently (see `summarize_all`), or with the OpenAI
+        Batch API if `use_batch_api` is True (see `summarize_with_batch_api`)
     - Saves each article record in a new-line delimited JSON file
     - If a new article is summarized, it is cached to be skipped later
 
     Parameters
     ----------
-    - article_records (list): A list of records for news articles.
+    - article_records (list): A list of records for news articles that have not
+        been summarized yet.
+    - use_batch_api (bool): If True, use the OpenAI Batch API. Default: False
 
     Returns
     -------
@@ -226,86 +528,124 @@ def summarize_articles(article_records):
     - Summarized article records are saved in a new-line delimited JSON file.
     - Summarized links are cached to be skipped later.
     """
-    print("Setting output filenames...")
+    logger.info("Setting output filenames...")
     today_str = datetime.date.today().strftime("%Y_%m_%d")
     summaries_fp = os.path.join(SUMMARIES_DIR, f"{today_str}__{SUMMARY_FILE}")
     links_fp = os.path.join(DOWNLOADED_LINKS_DIR, f"{today_str}__{LINKS_FILE}")
 
-    # Load downloaded links to skip, if any
-    print("Loading cached URLs that have already been summarized...")
-    files = collect_last_x_files(path=DOWNLOADED_LINKS_DIR, max_paths=NUM_DAYS)
-    downloaded_links_set = load_downloaded_links(files)
-    print(f"Number of URLs in cache: {len(downloaded_links_set)}")
-
     # Open output files for new records and links cache
-    with open(summaries_fp, "a") as f_art, open(links_fp, "a") as f_links:
-        try:
-            num_new_articles = 0
-            num_skipped_articles = 0
-            num_records = len(article_records)
-            print(f"Begin summarizing {num_records} articles...")
-            for idx, article in enumerate(article_records, start=1):
+    with JsonlSink(summaries_fp, flush_size=WRITE_BUFFER_SIZE) as f_art, JsonlSink(
+        links_fp, flush_size=WRITE_BUFFER_SIZE
+    ) as f_links:
+        logger.info(f"Begin summarizing {len(article_records)} articles...")
+        if use_batch_api:
+            summarize_coro = summarize_with_batch_api(article_records, f_art, f_links)
+        else:
+            summarize_coro = summarize_all(article_records, f_art, f_links)
+        num_new_articles = asyncio.run(summarize_coro)
+
+    logger.info(f"Number of new articles    : {num_new_articles}")
 
-                link = article["link"]
-                if link in downloaded_links_set:
-                    # print("\t- Already summarized, skipping")
-                    num_skipped_articles += 1
-                    continue
+    return
 
-                print(f"Processing article {idx}/{num_records}")
-                print(f"\t- URL: {link}")
 
-                # Extract article text, ensure it is not too long for OpenAI
-                article_text = article["text"]
-                trimmed_text = trim_text_to_token_limit(article_text)
+def acquire_run_lock(lock_fp):
+    """
+    Take an exclusive lock on `lock_fp` without waiting for it.
 
-                # Make request, parse response and add to the record
-                response = summarize(article_text=trimmed_text, raw=True)
-                parsed_response = parse_response(response)
-                article.update(parsed_response)
+    Parameters
+    ----------
+    - lock_fp (str): The path to the lock file. Created if it does not exist.
 
-                # Save article record
-                json_line = f"{json.dumps(article)}\n"
-                f_art.write(json_line)
+    Returns
+    -------
+    int or None: The locked file descriptor (the lock is released when it is closed or
+        the process exits), or None if another process holds the lock
+    """
+    fd = os.open(lock_fp, os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
 
-                # Save the downloaded link in the cache
-                f_links.write(f"{link}\n")
 
-                num_new_articles += 1
+def parse_command_line_flags():
+    """
+    Parses command line flags for the summarization script.
 
-        except Exception as e:
-            print(f"Error processing URL <{article['link']}>: {e}")
-            print("-" * 50)
+    Returns:
+    ---------
+    - args (Namespace): Parsed command-line arguments.
+    """
+    parser = argparse.ArgumentParser(description="Summarize article data with OpenAI.")
+    parser.add_argument(
+        "--batch_api",
+        action="store_true",
+        help="Summarize with the OpenAI Batch API instead of real-time requests.",
+    )
+    return parser.parse_args()
 
-    print(f"Number of new articles    : {num_new_articles}")
-    print(f"Number of skipped articles: {num_skipped_articles}")
 
-    return
+if __name__ == "__main__":
+    args = parse_command_line_flags()
+    start_queue_logging(logger)
 
+    # Skip this run if another one is still summarizing
+    lock_fd = acquire_run_lock(os.path.join(DOWNLOADED_LINKS_DIR, LOCK_FILE))
+    if lock_fd is None:
+        logger.info("Another summarization run is in progress. Skipping this run.")
+        sys.exit(0)
 
-if __name__ == "__main__":
-    print("-" * 50)
-    print("Start article summarization script.")
-    print("-" * 50)
+    logger.info("-" * 50)
+    logger.info("Start article summarization script.")
+    logger.info("-" * 50)
 
-    print("Prompt:")
-    print(PROMPT1)
-    print("-" * 50)
+    logger.info("Prompt:")
+    logger.info(PROMPT1)
+    logger.info("-" * 50)
 
     # Load data
     article_record_files = collect_last_x_files(
         path=ARTICLE_RECORDS_DIR, max_paths=NUM_DAYS
     )
-    print("Article files to be processed:", *article_record_files, sep="\n- ")
-    print("-" * 50)
+    logger.info("\n- ".join(["Article files to be processed:", *article_record_files]))
+    logger.info("-" * 50)
+
+    # Load downloaded links to skip, if any
+    logger.info("Loading cached URLs that have already been summarized...")
+    files = collect_last_x_files(path=DOWNLOADED_LINKS_DIR, max_paths=NUM_DAYS)
+    downloaded_links_set = load_downloaded_links(files)
+    logger.info(f"Number of URLs in cache: {len(downloaded_links_set)}")
 
-    # Extract records that we may need to process
+    # Extract records that we need to process. Records that were already summarized
+    # or are repeated are dropped as each file is loaded, so their text is freed.
+    # Records without text (failed downloads) are dropped too.
+    num_records = 0
+    num_missing_text = 0
     article_records = []
+    seen_links = set()
     for file in article_record_files:
-        article_records.extend(load_article_records(file))
-    print(f"Number of records: {len(article_records)}")
-    print("-" * 50)
-
-    # Process records, skipping those we already have
-    summarize_articles(article_records)
-    print("--- Script Complete ---")
+        for record in load_article_records(file):
+            num_records += 1
+            link = record["link"]
+            if link in downloaded_links_set or link in seen_links:
+                continue
+            if not record.get("text"):
+                num_missing_text += 1
+                continue
+            seen_links.add(link)
+            article_records.append(record)
+    logger.info(f"Number of records: {num_records}")
+    logger.info(f"Number of skipped articles: {num_records - len(article_records)}")
+    logger.info(f"\t- Articles without text: {num_missing_text}")
+    logger.info("-" * 50)
+
+    # Trim article texts so they are not too long for OpenAI
+    trim_article_texts(article_records)
+
+    # Process records
+    summarize_articles(article_records, use_batch_api=args.batch_api)
+    os.close(lock_fd)
+    logger.info("--- Script Complete ---")
@@ -38,23 +38,34 @@ Output:
 Author: Matthew DeVerna
 """
 import datetime
+import gzip
+import hashlib
 import json
+import logging
 import os
 import random
 import requests
+import threading
 import time
 import tldextract
 
 import pandas as pd
 
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+
 from fake_useragent import UserAgent
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from serpapi import GoogleSearch
 from newspaper import Config
 from newspaper import Article
 
 from reliable_db.cookies import COOKIES_MAP
 from reliable_db.serp_models import SerpGnewsArticle
-from reliable_db.utils import get_class_property_dict
+from reliable_db.utils import get_class_property_dict, start_queue_logging
+
+logger = logging.getLogger(__name__)
 
 # Make sure we are in the proper directory for the relative output dirs/files
 CURR_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -65,6 +76,25 @@ if os.getcwd() != CURR_DIR:
 OS = "macos"
 fake_user_agent = UserAgent(os="macos")
 
+# Maximum number of domains downloaded from at once
+MAX_WORKERS = 8
+
+# One user agent per domain, so it does not change mid-session
+DOMAIN_USER_AGENTS = {}
+
+# Shared session, so connections to each host are kept alive and reused
+POOL_SIZE = 50
+REQUEST_TIMEOUT = (5, 30)  # (connect, read) seconds
+SESSION = requests.Session()
+SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=POOL_SIZE,
+        pool_maxsize=POOL_SIZE,
+        max_retries=Retry(total=3, backoff_factor=0.5),
+    ),
+)
+
 # Input dataframe
 DATA_DIR = "../../data/domains/"
 DOMAINS_FILE = "selected_reliable_domains.csv"
@@ -76,6 +106,10 @@ os.makedirs(OUT_DIR, exist_ok=True)
 SERP_FILE = "serp_results.jsonl"
 ARTICLE_FILE = "article_results.jsonl"
 
+# Article HTML is stored outside of the records, in HTML_DIR/<hash[:2]>/<hash>.html.gz
+HTML_DIR = os.path.join(OUT_DIR, "html")
+HTML_COMPRESSLEVEL = 1
+
 # Set API key
 SERP_API_KEY = os.environ.get("SERP_API_KEY")
 if not SERP_API_KEY:
@@ -124,16 +158,83 @@ def random_wait(min=1, max=5):
         raise ValueError("min and max must be integers.")
 
     random_wait = 1 + random.uniform(min, max)
-    print(f"\t- Sleeping for {random_wait:.2f} seconds.")
+    logger.info(f"\t- Sleeping for {random_wait:.2f} seconds.")
     time.sleep(random_wait)
 
 
+def fetch_article(url, delay=False):
+    """
+    Download an article, optionally after a random wait.
+
+    Parameters
+    ----------
+    - url (str): The URL to fetch.
+    - delay (bool): If True, call `random_wait` before making the request.
+
+    Returns
+    -------
+    requests.Response: The response object.
+    """
+    if delay:
+        # Be nice, don't get banned. :P
+        random_wait()
+    return make_request(url)
+
+
+def process_domain_articles(domain_articles, f_art, write_lock, fetch_executor):
+    """
+    Process articles from a single domain one by one, waiting between requests.
+    The next article is downloaded on `fetch_executor` while the current one is
+    parsed, so parsing overlaps with the wait and the download of the next article.
+
+    Parameters
+    ----------
+    - domain_articles (list): A list of Google News articles from the same domain.
+    - f_art (file): The article records output file.
+    - write_lock (threading.Lock): Lock serializing writes to `f_art` across workers.
+    - fetch_executor (ThreadPoolExecutor): Executor that downloads the articles.
+
+    Returns
+    -------
+    list: A list of dictionaries, each containing details of an article.
+    """
+    article_records = []
+    next_response = fetch_executor.submit(fetch_article, domain_articles[0]["link"])
+    for idx, article in enumerate(domain_articles):
+        logger.info(f"\t- Processing URL: {article['link']}")
+
+        # Start the next download only once this one finished, so each domain still
+        # gets a single request at a time with a random wait in between
+        response_future = next_response
+        wait([response_future])
+        if idx + 1 < len(domain_articles):
+            next_url = domain_articles[idx + 1]["link"]
+            next_response = fetch_executor.submit(fetch_article, next_url, delay=True)
+
+        try:
+            response = response_future.result()
+            serp_article = SerpGnewsArticle(article)
+            article_record = get_article_details(serp_article, response=response)
+
+            json_line = f"{json.dumps(article_record)}\n"
+            with write_lock:
+                f_art.write(json_line)
+            article_records.append(article_record)
+        except Exception as e:
+            logger.error(f"Error processing URL <{article['link']}>: {e}")
+            logger.info("-" * 50)
+
+    return article_records
+
+
 def process_articles(articles):
     """
     Process a list of articles returned by the SERP API.
 
     Notes:
-    - Downloads content from each article one by one with newspaper3k.
+    - Groups articles by domain and processes each domain's articles in a separate
+        thread (at most MAX_WORKERS at a time), waiting between requests to the same
+        domain. Downloads run on a second pool so they overlap with parsing.
     - Parses content with the SerpGnewsArticle class.
     - Saves each article record in a new-line delimited JSON file.
 
@@ -152,24 +253,28 @@ def process_articles(articles):
     today_str = datetime.date.today().strftime("%Y_%m_%d")
     article_fp = os.path.join(OUT_DIR, f"{today_str}__{ARTICLE_FILE}")
 
-    article_records = []
-    with open(article_fp, "a") as f_art:
-        try:
-            for idx, article in enumerate(articles[:2], start=1):
-                print(f"\t- Processing article {idx}/{len(articles)}")
-                print(f"\t\t- URL: {article['link']}")
+    articles_by_domain = defaultdict(list)
+    for article in articles:
+        extracted = tldextract.extract(article["link"])
+        articles_by_domain[extracted.registered_domain].append(article)
 
-                serp_article = SerpGnewsArticle(article)
-                article_record = get_article_details(serp_article)
-
-                json_line = f"{json.dumps(article_record)}\n"
-                f_art.write(json_line)
-
-                # Be nice, don't get banned. :P
-                random_wait()
-        except Exception as e:
-            print(f"Error processing URL <{article['link']}>: {e}")
-            print("-" * 50)
+    article_records = []
+    write_lock = threading.Lock()
+    with open(article_fp, "a") as f_art, ThreadPoolExecutor(
+        max_workers=MAX_WORKERS
+    ) as fetch_executor, ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = [
+            executor.submit(
+                process_domain_articles,
+                domain_articles,
+                f_art,
+                write_lock,
+                fetch_executor,
+            )
+            for domain_articles in articles_by_domain.values()
+        ]
+        for future in as_completed(futures):
+            article_records.extend(future.result())
 
     return article_records
 
@@ -190,29 +295,45 @@ def make_request(url):
         # Use requests to fetch the web page
         extracted = tldextract.extract(url)
         domain = ".".join([extracted.domain, extracted.suffix])
-        if COOKIES_MAP.get(domain, None):
-            response = requests.get(
-                url,
-                cookies=COOKIES_MAP[domain],
-                headers={
-                    "user-agent": fake_user_agent.random,
-                    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
-                },
-            )
-        else:
-            response = requests.get(
-                url,
-                headers={
-                    "user-agent": fake_user_agent.random,
-                    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
-                },
-            )
+        if domain not in DOMAIN_USER_AGENTS:
+            DOMAIN_USER_AGENTS[domain] = fake_user_agent.random
+        response = SESSION.get(
+            url,
+            cookies=COOKIES_MAP.get(domain, None),
+            headers={
+                "user-agent": DOMAIN_USER_AGENTS[domain],
+                "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
+            },
+            timeout=REQUEST_TIMEOUT,
+        )
     except Exception as e:
         raise Exception(f"Error fetching URL <{url}>: {e}")
     return response
 
 
-def get_article_details(serp_article):
+def save_article_html(url, html):
+    """
+    Save an article's HTML as a gzipped file named after the SHA-1 hash of its URL.
+
+    Parameters
+    ----------
+    - url (str): The article URL.
+    - html (str): The article HTML.
+
+    Returns
+    -------
+    str: The path to the saved file.
+    """
+    url_hash = hashlib.sha1(url.encode("utf-8")).hexdigest()
+    html_dir = os.path.join(HTML_DIR, url_hash[:2])
+    os.makedirs(html_dir, exist_ok=True)
+    html_fp = os.path.join(html_dir, f"{url_hash}.html.gz")
+    with gzip.open(html_fp, "wb", compresslevel=HTML_COMPRESSLEVEL) as f:
+        f.write(html.encode("utf-8"))
+    return html_fp
+
+
+def get_article_details(serp_article, response=None):
     """
     Given a SerpGnewsArticle, download and extract the article details.
 
@@ -220,13 +341,15 @@ def get_article_details(serp_article):
     ----------
     - serp_article (SerpGnewsArticle): SerpGnewsArticle class based on SERP API response.
         Keys included: ['position', 'title', 'source', 'link', 'thumbnail', 'date']
+    - response (requests.Response): The already downloaded article, if any. If None
+        (default), the article is downloaded with `make_request`.
 
     Returns
     -------
     article_record (dict): The article record.
         - Keys include:
             ['authors', 'gnews_position', 'link', 'publisher', 'serp_date',
-            'title', 'text', 'article_text', 'article_html', 'n3k_publish_date']
+            'title', 'text', 'article_text', 'article_html_path', 'n3k_publish_date']
         - See the SerpGnewsArticle class for more details.
 
     Examples
@@ -235,7 +358,8 @@ def get_article_details(serp_article):
     """
     # Download the article using cookies, if present
     url = serp_article.link
-    response = make_request(url)
+    if response is None:
+        response = make_request(url)
 
     # Parse the article using newspaper3k
     n3k_article = Article(url="")
@@ -253,9 +377,9 @@ def get_article_details(serp_article):
     if n3k_article.publish_date:
         article_record["n3k_publish_date"] = n3k_article.publish_date.timestamp()
 
-    article_record["article_html"] = None
+    article_record["article_html_path"] = None
     if n3k_article.html:
-        article_record["article_html"] = n3k_article.html
+        article_record["article_html_path"] = save_article_html(url, n3k_article.html)
 
     return article_record
 
@@ -281,6 +405,8 @@ def main(quality_domains_df, api_key):
     """
 
     num_domains = len(quality_domains_df)
+    # Gather every domain's results first so all domains are downloaded concurrently
+    all_articles = []
     for idx, row in quality_domains_df.iterrows():
         # Update SERP_FILE and ARTICLE_FILE to include current date
         today_str = datetime.date.today().strftime("%Y_%m_%d")
@@ -288,29 +414,38 @@ def main(quality_domains_df, api_key):
 
         with open(serp_fp, "a") as f_serp:
             try:
-                print(f"Source {idx + 1}/{num_domains}: {row.domain}...")
+                logger.info(f"Source {idx + 1}/{num_domains}: {row.domain}...")
                 results = fetch_serp_data(api_key, row.gnews_pub_token)
                 json_line = f"{json.dumps(results)}\n"
                 f_serp.write(json_line)
 
                 if not results.get("news_results", None):
-                    print("*** No news results found. ***")
+                    logger.info("*** No news results found. ***")
                     continue
 
                 else:
-                    print(f"\t- Num results found: {len(results['news_results'])}")
-                    articles = results["news_results"]
-                    print(f"\t- Num articles found: {len(articles)}")
-                    process_articles(articles)
+                    logger.info(
+                        f"\t- Num results found: {len(results['news_results'])}"
+                    )
+                    articles = results["news_results"][:2]
+                    logger.info(f"\t- Num articles found: {len(articles)}")
+                    all_articles.extend(articles)
 
-                print("Done collecting data for this domain.")
-                print("-" * 50)
+                logger.info("Done collecting SERP data for this domain.")
+                logger.info("-" * 50)
 
             except Exception as e:
-                print(f"Error processing domain {row.domain}: {e}")
-                print("-" * 50)
+                logger.error(f"Error processing domain {row.domain}: {e}")
+                logger.info("-" * 50)
+
+    logger.info(f"Processing {len(all_articles)} articles...")
+    try:
+        process_articles(all_articles)
+    except Exception as e:
+        logger.error(f"Error processing articles: {e}")
 
 
 if __name__ == "__main__":
+    start_queue_logging(logger)
     quality_domains_df = pd.read_csv(DOMAINS_PATH)
     main(quality_domains_df, SERP_API_KEY)
@@ -31,14 +31,13 @@ Author: Matthew DeVerna
 
 import sys
 import argparse
-import chromadb
-import json
+import hashlib
+import itertools
 
 import pandas as pd
 
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from nltk.tokenize import sent_tokenize
-from reliable_db.utils import collect_last_x_files
+from concurrent.futures import ThreadPoolExecutor
+from reliable_db.utils import collect_last_x_files, json_loads
 
 CHROMA_DIR = "/home/data/apps/llm_facebook_browser_extension/vector_dbs"
 SUMMARIES_DIR = "/home/data/apps/llm_facebook_browser_extension/raw_data/article_data/article_results_summarized"
@@ -50,6 +49,27 @@ METADATA_COLUMNS = [
     "title",
 ]
 
+# Maximum number of summary files loaded at the same time
+MAX_LOAD_WORKERS = 8
+
+# Number of bytes of the link hash used in document IDs (hex IDs are twice as long)
+ID_HASH_SIZE = 12
+
+# Number of records added to the collection per `collection.add` call
+BATCH_SIZE = 166
+
+# Maximum number of links in each `$in` filter when checking for existing links,
+# to stay below SQLite's limit on query parameters
+LINK_QUERY_CHUNK_SIZE = 1000
+
+# SQLite settings that skip journaling and fsyncs while loading (--unsafe_fast_ingest)
+FAST_INGEST_PRAGMAS = [
+    "pragma journal_mode=off",
+    "pragma synchronous=off",
+    "pragma temp_store=memory",
+    "pragma locking_mode=exclusive",
+]
+
 
 def parse_command_line_flags():
     """
@@ -106,10 +126,28 @@ def parse_command_line_flags():
         type=int,
         help=help_msg,
     )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=BATCH_SIZE,
+        help=f"Number of records added to the collection at a time (default = {BATCH_SIZE}).",
+    )
+    help_msg = (
+        "Turn off SQLite journaling and syncing while adding records. Faster, but the "
+        "database can be corrupted if the script crashes. Back it up first."
+    )
+    parser.add_argument(
+        "--unsafe_fast_ingest",
+        action="store_true",
+        help=help_msg,
+    )
 
     # Parse arguments
     args = parser.parse_args()
 
+    if args.batch_size < 1:
+        parser.error("--batch_size must be greater than 0.")
+
     # Implementing conditional logic based on summaries_split
     if args.summaries_split:
         if not args.separators or args.chunk_size is None or args.chunk_overlap is None:
@@ -158,9 +196,26 @@ def create_database_name(args, is_sentences):
     return db_name
 
 
+def load_records(file_path):
+    """
+    Load article records from a single jsonl file.
+
+    Parameters:
+    -----------
+    - file_path (str) : full path to an article summaries jsonl file.
+
+    Returns:
+    -----------
+    - records (List[dict]) : the records in the file
+    """
+    with open(file_path, "rb") as f:
+        return [json_loads(line) for line in f.read().splitlines() if line]
+
+
 def load_records_as_df(files):
     """
-    Load article records data into a dataframe.
+    Load article records data into a dataframe. Files are read in parallel, with
+    up to MAX_LOAD_WORKERS threads, and records keep the order of `files`.
 
     Parameters:
     -----------
@@ -170,15 +225,42 @@ def load_records_as_df(files):
     -----------
     - records_df (pandas.DataFrame) : dataframe with record keys as columns
     """
-    records = []
-    for file_path in files:
-        with open(file_path, "r") as f:
-            for line in f:
-                records.append(json.loads(line))
+    with ThreadPoolExecutor(max_workers=MAX_LOAD_WORKERS) as executor:
+        records_per_file = list(executor.map(load_records, files))
+    records = list(itertools.chain.from_iterable(records_per_file))
     records_df = pd.DataFrame.from_records(records)
     return records_df
 
 
+def split_summaries(df, split_text):
+    """
+    Split each article summary with `split_text` and give each piece its own row,
+    duplicating all other columns. Pieces are collected directly with the position of
+    their parent row, rather than stored as a list column and exploded.
+    Summaries that split into no pieces are dropped.
+
+    Parameters:
+    -----------
+    - df (DataFrame): The original dataframe. Must have an 'article_summary' column.
+    - split_text (callable): Function splitting one summary into a list of strings.
+
+    Returns:
+    -----------
+    - DataFrame: A new dataframe with one row per piece.
+    """
+    parent_indices = []
+    pieces = []
+    for idx, summary in enumerate(df["article_summary"]):
+        summary_pieces = split_text(summary)
+        parent_indices.extend([idx] * len(summary_pieces))
+        pieces.extend(summary_pieces)
+
+    df_split = df.drop(columns="article_summary").take(parent_indices)
+    df_split = df_split.reset_index(drop=True)
+    df_split.insert(df.columns.get_loc("article_summary"), "article_summary", pieces)
+    return df_split
+
+
 def split_summaries_into_sentences(df):
     """
     Splits article summaries into individual sentences and duplicates the associated columns.
@@ -192,14 +274,13 @@ def split_summaries_into_sentences(df):
     - DataFrame: A new dataframe where each row represents a single sentence from the article summaries.
         All other data is duplicated.
     """
-    # Tokenize the 'article_summary' into sentences and create a list
-    df = df.copy()
-    df["article_summary"] = df["article_summary"].apply(sent_tokenize)
+    import blingfire
 
-    # Explode the 'article_summary' list into separate rows
-    df_exploded = df.explode("article_summary").reset_index(drop=True)
+    def split_sentences(text):
+        # blingfire returns the sentences of `text` separated by new lines
+        return [s for s in blingfire.text_to_sentences(text).split("\n") if s]
 
-    return df_exploded
+    return split_summaries(df, split_sentences)
 
 
 def split_summaries_with_splitter(df, splitter):
@@ -217,19 +298,88 @@ def split_summaries_with_splitter(df, splitter):
     - DataFrame: A new dataframe where each row represents a single text chunk split from
         the article summaries. All other data is duplicated.
     """
-    # Tokenize the 'article_summary' into sentences and create a list
-    df = df.copy()
-    df["article_summary"] = df["article_summary"].apply(splitter.split_text)
+    return split_summaries(df, splitter.split_text)
+
+
+def get_links_already_present(collection, links, chunk_size=LINK_QUERY_CHUNK_SIZE):
+    """
+    Find which of `links` are already in the collection. Only records matching
+    `links` are fetched, `chunk_size` links per query.
+
+    Parameters:
+    -----------
+    - collection (chromadb.Collection): the collection to check
+    - links (List[str]): the links to look for
+    - chunk_size (int): the number of links per query (default = LINK_QUERY_CHUNK_SIZE)
+
+    Returns:
+    -----------
+    - set: the links that are already in the collection
+    """
+    links_already_present = set()
+    for start in range(0, len(links), chunk_size):
+        existing = collection.get(
+            where={"link": {"$in": links[start : start + chunk_size]}},
+            include=["metadatas"],
+        )
+        links_already_present.update(item["link"] for item in existing["metadatas"])
+    return links_already_present
 
-    # Explode the 'article_summary' list into separate rows
-    df_exploded = df.explode("article_summary").reset_index(drop=True)
 
-    return df_exploded
+def enable_fast_ingest(client):
+    """
+    Apply FAST_INGEST_PRAGMAS to the SQLite connection of a Chroma persistent client.
+    These disable crash safety for the rest of the process.
+
+    Parameters:
+    -----------
+    - client (chromadb.PersistentClient): the client to update
+
+    Returns:
+    -----------
+    - bool: True if the pragmas were applied, False otherwise
+    """
+    try:
+        # Not part of Chroma's public API, so this may break between versions
+        conn = client._sysdb._conn_pool.connect()
+        for pragma in FAST_INGEST_PRAGMAS:
+            conn.execute(pragma)
+    except Exception as e:
+        print(f"Could not apply fast ingest SQLite settings: {e}")
+        return False
+    return True
+
+
+def create_document_ids(df):
+    """
+    Create a document ID for each record from its link and its position among the
+    records with the same link: '<blake2b hash of link>_<chunk index>'. The same
+    document always gets the same ID, so adding it again does not create a duplicate.
 
+    Parameters:
+    -----------
+    - df (pandas.DataFrame): the dataframe of records. Must contain a 'link' column.
 
-def add_records_to_collection(df, collection):
+    Returns:
+    -----------
+    - List[str]: the document IDs, in the order of `df`
     """
-    Add records from dataframe to the specified collection.
+    link_hashes = {
+        link: hashlib.blake2b(
+            link.encode("utf-8"), digest_size=ID_HASH_SIZE
+        ).hexdigest()
+        for link in df["link"].unique()
+    }
+    chunk_indices = df.groupby("link", sort=False).cumcount()
+    return [
+        f"{link_hashes[link]}_{idx}" for link, idx in zip(df["link"], chunk_indices)
+    ]
+
+
+def add_records_to_collection(df, collection, batch_size=BATCH_SIZE):
+    """
+    Add records from dataframe to the specified collection, `batch_size` records
+    per `collection.add` call. Document IDs are created by `create_document_ids`.
 
     Parameters:
     -----------
@@ -237,23 +387,38 @@ def add_records_to_collection(df, collection):
         following columns:
         - article_summary: summaries or split summaries. Will become the "documents"
         - link : the URLs for the articles
+    - collection (chromadb.Collection): the collection to add records to
+    - batch_size (int): the number of records to add at a time (default = BATCH_SIZE)
     """
 
-    num_items = collection.count()
-    ids = [str(i).zfill(12) for i in range(num_items + 1, len(df) + num_items + 1)]
-    metadatas = df[METADATA_COLUMNS].to_dict(orient="records")
-    documents = df.article_summary.tolist()
-    collection.add(
-        ids=ids,
-        metadatas=metadatas,
-        documents=documents,
-    )
+    ids = create_document_ids(df)
+
+    # Metadata values are converted to plain strings (missing values to "") up front
+    meta_df = df[METADATA_COLUMNS].astype("string").fillna("")
+    for start in range(0, len(df), batch_size):
+        end = start + batch_size
+        batch_meta_df = meta_df.iloc[start:end]
+        metadatas = [
+            dict(zip(METADATA_COLUMNS, row))
+            for row in batch_meta_df.itertuples(index=False, name=None)
+        ]
+        documents = df.article_summary.iloc[start:end].tolist()
+        collection.add(
+            ids=ids[start:end],
+            metadatas=metadatas,
+            documents=documents,
+        )
 
 
 if __name__ == "__main__":
 
     print("Setting up the splitting parameters...")
     args = parse_command_line_flags()
+
+    # Heavy imports are only needed once the arguments are valid
+    import chromadb
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
     if args.summaries_split:
         is_sentences = any(i in ["sentence", "sentences"] for i in args.separators)
         args.separators = "sentences" if is_sentences else args.separators
@@ -271,6 +436,9 @@ if __name__ == "__main__":
     db_name = create_database_name(args, is_sentences)
     print(f"Database Name: {db_name}")
     client = chromadb.PersistentClient(CHROMA_DIR)
+    if args.unsafe_fast_ingest:
+        print("Turning off SQLite journaling and syncing (--unsafe_fast_ingest)...")
+        enable_fast_ingest(client)
     collection = client.get_or_create_collection(
         name=db_name,
         metadata={  # Dictionary describing the parameters used to create the collection!
@@ -285,41 +453,47 @@ if __name__ == "__main__":
     print("Loading summaries...")
     files = collect_last_x_files(SUMMARIES_DIR)  # Includes all summary files
     records_df = load_records_as_df(files)
-    records_df.publisher = records_df.publisher
+    if records_df.empty:
+        print("No summaries found!")
+        print("--- Script complete ---")
+        sys.exit(0)
 
     print("Removing duplicate articles within the dataframe...")
-    records_df = records_df.drop_duplicates(subset="link").reset_index(drop=True)
+    unique_mask = ~records_df["link"].duplicated(keep="first")
+    records_df = records_df.loc[unique_mask].reset_index(drop=True)
 
     print("Finding any links that are already present in the database...")
     # Creates an empty set if there are none
-    links_already_present = set(
-        item["link"] for item in collection.get(include=["metadatas"])["metadatas"]
+    links_already_present = get_links_already_present(
+        collection, records_df.link.tolist()
     )
 
     duplicates_mask = records_df.link.isin(links_already_present)
     print(f"Excluding {duplicates_mask.sum()} duplicate links...")
     records_df = records_df[~duplicates_mask].reset_index(drop=True)
 
-    if len(records_df) > 0:
-        if args.summaries_split:
-            if args.separators == "sentences":
-                print("Splitting by sentences...")
-                records_df = split_summaries_into_sentences(records_df)
-
-            else:
-                print("Splitting by characters...")
-                splitter = RecursiveCharacterTextSplitter(
-                    separators=args.separators,
-                    chunk_size=args.chunk_size,
-                    chunk_overlap=args.chunk_overlap,
-                )
-                records_df = split_summaries_with_splitter(records_df, splitter)
-
-        print(f"Adding new records {len(records_df):,}...")
-        add_records_to_collection(records_df, collection)
-        print("Done.")
-
-    else:
+    # Stop before splitting or embedding anything if every article is already indexed
+    if records_df.empty:
         print("No new documents to add!")
+        print("--- Script complete ---")
+        sys.exit(0)
+
+    if args.summaries_split:
+        if args.separators == "sentences":
+            print("Splitting by sentences...")
+            records_df = split_summaries_into_sentences(records_df)
+
+        else:
+            print("Splitting by characters...")
+            splitter = RecursiveCharacterTextSplitter(
+                separators=args.separators,
+                chunk_size=args.chunk_size,
+                chunk_overlap=args.chunk_overlap,
+            )
+            records_df = split_summaries_with_splitter(records_df, splitter)
+
+    print(f"Adding new records {len(records_df):,}...")
+    add_records_to_collection(records_df, collection, batch_size=args.batch_size)
+    print("Done.")
 
     print("--- Script complete ---")
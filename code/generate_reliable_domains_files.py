@@ -12,7 +12,11 @@ Author: Matthew DeVerna
 import os
 import pandas as pd
 
-from reliable_db.constants import MBFC_LEAN_MAP, SELECTED_DOMAINS, GNEWS_PUB_TOKEN_MAP
+from reliable_db.constants import (
+    MBFC_LEAN_SERIES,
+    SELECTED_DOMAINS,
+    GNEWS_PUB_TOKEN_SERIES,
+)
 
 # Make sure we are in the proper directory for the relative output dirs/files
 CURR_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -59,8 +63,10 @@ quality_sites.sort_values(by=["tranco_rank", "newsguard_score"], inplace=True)
 print(quality_sites)
 
 # Add MBFC biases and Gnews publisher tokens
-quality_sites["mbfc_bias"] = quality_sites["domain"].map(MBFC_LEAN_MAP)
-quality_sites["gnews_pub_token"] = quality_sites["domain"].map(GNEWS_PUB_TOKEN_MAP)
+for series in (MBFC_LEAN_SERIES, GNEWS_PUB_TOKEN_SERIES):
+    quality_sites = quality_sites.merge(
+        series, left_on="domain", right_index=True, how="left"
+    )
 
 # Save this file
 output_file = os.path.join(
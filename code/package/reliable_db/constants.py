@@ -2,6 +2,8 @@
 Cumbersome constant objects for scripts are saved here to clean up other scripts.
 """
 
+import pandas as pd
+
 # Based on mediabiasfactcheck "bias" measurement as of 12/12/2023 of top 50 selected below
 MBFC_LEAN_MAP = {
     "yahoo.com": "least-biased",
@@ -103,3 +105,9 @@ GNEWS_PUB_TOKEN_MAP = {
     "wsj.com": "CAAqBwgKMNbcyQEw58sV",
     "newsweek.com": "CAAqBwgKMO-82wow4qvMAQ",
 }
+
+# The maps above as Series indexed by domain, for joining onto domain dataframes
+MBFC_LEAN_SERIES = pd.Series(MBFC_LEAN_MAP, name="mbfc_bias").rename_axis("domain")
+GNEWS_PUB_TOKEN_SERIES = pd.Series(
+    GNEWS_PUB_TOKEN_MAP, name="gnews_pub_token"
+).rename_axis("domain")
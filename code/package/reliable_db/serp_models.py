@@ -1,15 +1,34 @@
 """
 Data models for processing responses from models.
 """
-from reliable_db.utils import get_dict_val
+from reliable_db.utils import compile_path
 
 
 class SerpGnewsArticle:
     """
     Class for article objects from the Serp API, specific to Google News Search.
     - Ref: https://serpapi.com/google-news-api
+
+    Fields are extracted once, when the object is created:
+    - serp_date: the date of the article
+    - title: the title of the article
+    - authors: the author(s) of the article. If more than one author is present,
+        they are delimited by AUTHORS_DELIMITER (,)
+    - publisher: the publisher of the article (e.g., 'The New York Times')
+    - link: the article link
     """
 
+    __slots__ = ("serp_date", "title", "authors", "publisher", "link")
+
+    AUTHORS_DELIMITER = ","
+
+    # Getters for each field's key path in the Serp API article response
+    _GET_SERP_DATE = staticmethod(compile_path(["date"]))
+    _GET_TITLE = staticmethod(compile_path(["title"]))
+    _GET_LINK = staticmethod(compile_path(["link"]))
+    _GET_PUBLISHER = staticmethod(compile_path(["source", "name"]))
+    _GET_AUTHORS = staticmethod(compile_path(["source", "authors"]))
+
     def __init__(self, article_obj):
         """
         Initialize the class.
@@ -19,49 +38,14 @@ class SerpGnewsArticle:
                 "Invalid input object. Expected a dictionary representing a Google News "
                 "Serp API article response."
             )
-        self.article_obj = article_obj
-
-    @property
-    def serp_date(self):
-        """
-        Return the of the article.
-        """
-        return get_dict_val(self.article_obj, ["date"])
-
-    @property
-    def title(self):
-        """
-        Return the title of the article.
-        """
-        return get_dict_val(self.article_obj, ["title"])
-
-    @property
-    def authors(self, delimiter=","):
-        """
-        Return the author(s) of the article.
-        If more than one author is present, they are delimited by `delimiter`.
-        Default delimiter: ,
-        """
-        authors_list = get_dict_val(self.article_obj, ["source", "authors"])
-        if not authors_list:
-            return None
-        if len(authors_list) > 1:
-            return delimiter.join(authors_list)
-        return authors_list[0]
-
-    @property
-    def publisher(self):
-        """
-        Return the publisher of the article (e.g., 'The New York Times').
-        """
-        return get_dict_val(self.article_obj, ["source", "name"])
-
-    @property
-    def link(self):
-        """
-        Return the article link.
-        """
-        return get_dict_val(self.article_obj, ["link"])
+        self.serp_date = self._GET_SERP_DATE(article_obj)
+        self.title = self._GET_TITLE(article_obj)
+        self.link = self._GET_LINK(article_obj)
+        self.publisher = self._GET_PUBLISHER(article_obj)
+        authors_list = self._GET_AUTHORS(article_obj)
+        self.authors = (
+            self.AUTHORS_DELIMITER.join(authors_list) if authors_list else None
+        )
 
     def __repr__(self) -> str:
         return f"Pub: {self.publisher}\nURL: {self.link}"
@@ -2,12 +2,30 @@
 Utility functions for the reliable news database are saved here.
 """
 
+import asyncio
+import atexit
+import hashlib
+import heapq
 import inspect
+import json
+import logging
+import mmap
 import os
+import queue
 import random
-import tiktoken
+import sys
 import time
 
+from array import array
+from bisect import bisect_left
+from functools import lru_cache
+from logging.handlers import QueueHandler, QueueListener
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 def random_wait(min=1, max=5):
     """
@@ -21,10 +39,290 @@ def random_wait(min=1, max=5):
     time.sleep(wait_time)
 
 
+LOG_FORMAT = "%(asctime)s %(message)s"
+
+
+def start_queue_logging(logger, level=logging.INFO, stream=sys.stdout):
+    """
+    Configure the root logger to put records on a queue that a background thread
+    writes to `stream`, so logging calls never wait on the stream itself.
+    Only `logger` logs at `level`; other loggers (e.g., those of third-party
+    libraries like httpx) keep the default WARNING level.
+    The listener is stopped (and remaining records written) at exit.
+
+    Parameters
+    ----------
+    - logger (logging.Logger): The script's logger
+    - level (int): The minimum level `logger` logs (default = logging.INFO)
+    - stream (file): Where records are written (default = sys.stdout)
+
+    Returns
+    -------
+    logging.handlers.QueueListener: The started listener
+    """
+    log_queue = queue.Queue(-1)
+    stream_handler = logging.StreamHandler(stream)
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    listener = QueueListener(log_queue, stream_handler)
+    # Records are formatted once, by the listener's handler
+    logging.basicConfig(
+        level=logging.WARNING,
+        format="%(message)s",
+        handlers=[QueueHandler(log_queue)],
+        force=True,
+    )
+    logger.setLevel(level)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+def json_dumps(obj):
+    """
+    Serialize `obj` to JSON bytes. Uses orjson if it is installed, otherwise
+    falls back to the standard library.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode("utf-8")
+
+
+def json_loads(data):
+    """
+    Deserialize JSON from `data` (str or bytes). Uses orjson if it is installed,
+    otherwise falls back to the standard library.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class JsonlSink:
+    """
+    Append-only writer for new-line delimited files. Lines are collected in an
+    in-memory buffer and written to the file with `os.write` once the buffer holds
+    at least `flush_size` bytes, and when the sink is closed.
+
+    Examples
+    --------
+    with JsonlSink("records.jsonl") as sink:
+        sink.write({"link": "https://example.com"})
+    """
+
+    def __init__(self, path, flush_size=256 * 1024):
+        """
+        Initialize the class.
+
+        Parameters
+        ----------
+        - path (str): the file to append to. Created if it does not exist.
+        - flush_size (int): number of buffered bytes that triggers a write.
+        """
+        self.path = path
+        self.flush_size = flush_size
+        self._buffer = bytearray()
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def write(self, record):
+        """
+        Serialize `record` with `json_dumps` and add it as a new line.
+        """
+        self._buffer += json_dumps(record)
+        self._buffer += b"\n"
+        if len(self._buffer) >= self.flush_size:
+            self.flush()
+
+    def write_line(self, line):
+        """
+        Add the string `line` as a new line, without serializing it.
+        """
+        self._buffer += line.encode("utf-8")
+        self._buffer += b"\n"
+        if len(self._buffer) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write all buffered lines to the file.
+        """
+        with memoryview(self._buffer) as view:
+            offset = 0
+            while offset < len(view):
+                offset += os.write(self._fd, view[offset:])
+        self._buffer.clear()
+
+    def sync(self):
+        """
+        Write all buffered lines and force them to disk with `os.fsync`.
+        """
+        self.flush()
+        os.fsync(self._fd)
+
+    def close(self):
+        """
+        Write all buffered lines and close the file.
+        """
+        if self._fd is None:
+            return
+        try:
+            self.flush()
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def iter_file_lines(path):
+    """
+    Yield each line (bytes, including the new-line character) of the file at `path`.
+    The file is memory-mapped, which avoids Python's text I/O layer.
+    """
+    if os.path.getsize(path) == 0:
+        return
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        yield from iter(mm.readline, b"")
+
+
+class AsyncRateLimiter:
+    """
+    Token bucket rate limiter for asyncio code. Up to `max_rate` acquisitions are
+    allowed at once (a burst), and capacity refills continuously at `max_rate`
+    per `time_period` seconds. Waiting callers are served in order.
+
+    Examples
+    --------
+    limiter = AsyncRateLimiter(max_rate=5, time_period=1)  # 5 requests per second
+    async with limiter:
+        await make_request()
+    """
+
+    def __init__(self, max_rate, time_period=1):
+        """
+        Initialize the class.
+
+        Parameters
+        ----------
+        - max_rate (int or float): capacity of the bucket, i.e., the number of
+            acquisitions allowed per `time_period`.
+        - time_period (int or float): seconds it takes to refill the full bucket.
+        """
+        if max_rate <= 0 or time_period <= 0:
+            raise ValueError("`max_rate` and `time_period` must be greater than 0.")
+        self.max_rate = max_rate
+        self.time_period = time_period
+        self._capacity = float(max_rate)
+        self._last_refill = time.monotonic()
+        self._lock = None
+
+    def _refill(self):
+        now = time.monotonic()
+        refill = (now - self._last_refill) * self.max_rate / self.time_period
+        self._capacity = min(self.max_rate, self._capacity + refill)
+        self._last_refill = now
+
+    async def acquire(self, amount=1):
+        """
+        Wait until `amount` capacity is available, then consume it.
+        """
+        if amount > self.max_rate:
+            raise ValueError("`amount` cannot be greater than `max_rate`.")
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            self._refill()
+            while self._capacity < amount:
+                missing = amount - self._capacity
+                await asyncio.sleep(missing * self.time_period / self.max_rate)
+                self._refill()
+            self._capacity -= amount
+
+    def drain(self, seconds):
+        """
+        Remove all current capacity plus `seconds` worth of refills, so that every
+        caller waits at least `seconds` before acquiring again. Useful when a
+        server reports that the rate limit was exceeded.
+        """
+        self._refill()
+        self._capacity = (
+            min(self._capacity, 0) - seconds * self.max_rate / self.time_period
+        )
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        return None
+
+
+class CompactLinkSet:
+    """
+    Read-only set of URLs that stores each URL as a 64-bit blake2b digest in a
+    single sorted array (8 bytes per URL rather than a full Python string).
+    Supports `link in links` and `len(links)`.
+
+    Membership is checked by digest, so two different URLs could collide. With
+    64-bit digests this is vanishingly unlikely for the number of URLs we cache.
+    """
+
+    def __init__(self, links=()):
+        """
+        Initialize the class.
+
+        Parameters
+        ----------
+        - links (iterable): URLs (str) to include in the set
+        """
+        self._digests = array("Q", sorted({self._digest(link) for link in links}))
+
+    @classmethod
+    def union(cls, link_sets):
+        """
+        Combine several CompactLinkSets into one, merging their sorted digest arrays
+        directly (no URLs are rebuilt or rehashed).
+
+        Parameters
+        ----------
+        - link_sets (iterable): CompactLinkSets to combine
+
+        Returns
+        -------
+        CompactLinkSet: A set containing the URLs of every set in `link_sets`.
+        """
+        digests = array("Q")
+        for digest in heapq.merge(*(link_set._digests for link_set in link_sets)):
+            if not digests or digests[-1] != digest:
+                digests.append(digest)
+        combined = cls()
+        combined._digests = digests
+        return combined
+
+    @staticmethod
+    def _digest(link):
+        digest = hashlib.blake2b(link.encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "little")
+
+    def __contains__(self, link):
+        if not isinstance(link, str):
+            return False
+        digest = self._digest(link)
+        idx = bisect_left(self._digests, digest)
+        return idx < len(self._digests) and self._digests[idx] == digest
+
+    def __len__(self):
+        return len(self._digests)
+
+
 def collect_last_x_files(path, max_paths=None):
     """
     Collect the full paths to the most recent `num_paths` files in `path`.
     Files in `path` are assumed to be prefixed with a date in the format YYYY_MM_DD.
+    Subdirectories and hidden files are ignored.
 
     Parameters
     ----------
@@ -46,22 +344,45 @@ def collect_last_x_files(path, max_paths=None):
         if max_paths < 1:
             raise ValueError("`max_paths` must be greater than 0.")
 
-    # Sorted in ascending order, meaning recent dates are last
-    files = sorted(os.listdir(path), reverse=True)
+    # Hidden files (e.g., lock files) are not data files
+    with os.scandir(path) as entries:
+        files = [
+            entry.name
+            for entry in entries
+            if entry.is_file() and not entry.name.startswith(".")
+        ]
+
+    # Most recent dates first. Only the top `max_paths` are selected, without
+    # sorting every file name
     if max_paths is None:
-        max_paths = len(files)
-    return [os.path.join(path, file) for file in files[:max_paths]]
+        files = sorted(files, reverse=True)
+    else:
+        files = heapq.nlargest(max_paths, files)
+    return [os.path.join(path, file) for file in files]
+
+
+# Names of each class's @properties and __slots__ attributes, found once per class by
+# `get_class_property_dict`
+_PROPERTY_NAMES_CACHE = {}
 
 
 def get_class_property_dict(obj):
     """
-    Return a dictionary of a class's @properties.
+    Return a dictionary of a class's @properties and __slots__ attributes.
     """
-    properties = {}
-    for name, attribute in inspect.getmembers(type(obj)):
-        if isinstance(attribute, property):
-            properties[name] = getattr(obj, name)
-    return properties
+    cls = type(obj)
+    names = _PROPERTY_NAMES_CACHE.get(cls)
+    if names is None:
+        names = {
+            name
+            for name, attribute in inspect.getmembers(cls)
+            if isinstance(attribute, property)
+        }
+        for klass in cls.__mro__:
+            names.update(getattr(klass, "__slots__", ()))
+        names = tuple(sorted(names))
+        _PROPERTY_NAMES_CACHE[cls] = names
+    return {name: getattr(obj, name) for name in names}
 
 
 def get_dict_val(dictionary: dict, key_list: list = []):
@@ -135,6 +456,44 @@ def get_dict_val(dictionary: dict, key_list: list = []):
     return retval
 
 
+def compile_path(key_list):
+    """
+    Return a function that retrieves the value at the end of the key path in
+    `key_list` from a dictionary, or None if the path does not exist. Like
+    `get_dict_val`, but the key path is checked once instead of on every call.
+
+    Parameters:
+    ----------
+    - key_list (list) : list of keys, each indicating another nested level further
+        down in the dictionary
+
+    Returns:
+    ----------
+    - function taking a dictionary and returning the key value (if present) or None
+
+    Examples:
+    ---------
+    get_source_name = compile_path(["source", "name"])
+    get_source_name({"source": {"name": "Reuters"}})
+    # Returns
+    'Reuters'
+    """
+    if not isinstance(key_list, list):
+        raise TypeError("`key_list` must be of type `list`")
+    key_path = tuple(key_list)
+
+    def get_value(dictionary):
+        value = dictionary
+        try:
+            for key in key_path:
+                value = value[key]
+        except (KeyError, TypeError, IndexError):
+            return None
+        return value
+
+    return get_value
+
+
 def get_nested_attr(obj, attr_path, default=None):
     """
     Retrieve a nested attribute from an object. Works like get_dict_val but for
@@ -159,6 +518,17 @@ def get_nested_attr(obj, attr_path, default=None):
     return current
 
 
+@lru_cache(maxsize=8)
+def _get_encoding(encoding_name):
+    """
+    Return the tiktoken encoding for `encoding_name`, building it only once.
+    """
+    # Imported here as loading tiktoken is slow and most callers do not need it
+    import tiktoken
+
+    return tiktoken.encoding_for_model(encoding_name)
+
+
 def num_tokens_from_string(string, encoding_name="gpt-3.5-turbo"):
     """
     Return the number of tokens in a text string.
@@ -172,7 +542,7 @@ def num_tokens_from_string(string, encoding_name="gpt-3.5-turbo"):
     ------------
     - num_tokens (int): the number of tokens in `string` based on `model`
     """
-    encoding = tiktoken.encoding_for_model(encoding_name)
+    encoding = _get_encoding(encoding_name)
     num_tokens = len(encoding.encode(string))
     return num_tokens
 
@@ -196,10 +566,58 @@ def trim_text_to_token_limit(text, encoding_name="gpt-3.5-turbo", max_tokens=350
     """
 
     # Calculate the number of tokens in the input text
-    encoding = tiktoken.encoding_for_model(encoding_name)
+    encoding = _get_encoding(encoding_name)
     tokens = encoding.encode(text)
 
     # If the number of tokens exceeds the limit return the truncated text
     if len(tokens) > max_tokens:
         return encoding.decode(tokens[:max_tokens])
     return text
+
+
+def num_tokens_from_strings(strings, encoding_name="gpt-3.5-turbo"):
+    """
+    Return the number of tokens in each of a list of text strings. The strings are
+    tokenized in one batch across threads. Special tokens (e.g., "<|endoftext|>")
+    are counted as ordinary text.
+
+    Parameters:
+    ------------
+    - strings (List[str]): texts for which we count tokens.
+    - encoding_name (str): An OpenAI chat completions model (default = gpt-3.5-turbo)
+
+    Returns
+    ------------
+    - num_tokens (List[int]): the number of tokens in each string, in the same order
+    """
+    encoding = _get_encoding(encoding_name)
+    token_lists = encoding.encode_batch(
+        strings, num_threads=os.cpu_count(), disallowed_special=()
+    )
+    return [len(tokens) for tokens in token_lists]
+
+
+def trim_texts_to_token_limit(texts, encoding_name="gpt-3.5-turbo", max_tokens=3500):
+    """
+    Trim each of a list of texts so it does not exceed a token limit. The texts are
+    tokenized in one batch across threads, with special tokens (e.g., "<|endoftext|>")
+    treated as ordinary text. See `trim_text_to_token_limit`.
+
+    Parameters:
+    ------------
+    - texts (List[str]): The input texts to trim.
+    - encoding_name (str): The encoding model name, default is "gpt-3.5-turbo".
+    - max_tokens (int): the maximum tokens to allow for each text.
+
+    Returns:
+    ------------
+    - trimmed_texts (List[str]): Trimmed texts that meet the token limit, in the same order.
+    """
+    encoding = _get_encoding(encoding_name)
+    token_lists = encoding.encode_batch(
+        texts, num_threads=os.cpu_count(), disallowed_special=()
+    )
+    return [
+        encoding.decode(tokens[:max_tokens]) if len(tokens) > max_tokens else text
+        for text, tokens in zip(texts, token_lists)
+    ]